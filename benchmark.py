@@ -0,0 +1,413 @@
+# ================================================================= #
+# ==          ULTIMATE TOOLKIT BOT - OFFLINE BENCHMARK           == #
+# ================================================================= #
+# Runs the real dispatcher and handlers from main.py against a local
+# stand-in for the Telegram Bot API and stubbed upstreams, replays a
+# synthetic stream of commands and reports throughput, p50/p99 latency
+# and memory per command. Nothing leaves the machine.
+#
+#   python benchmark.py --updates 500 --mix ip=3,github=2,qr=2,tts=1,yt=1,ping=3
+#   python benchmark.py --transport webhook --api-latency 0.05 --json results.json
+#   python benchmark.py --baseline results.json --max-regression 0.25   # exits 1 on regression
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import tracemalloc
+from types import SimpleNamespace
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+# main.py reads these at import time.
+BENCH_DIR = tempfile.mkdtemp(prefix="bot-bench-")
+BENCH_TOKEN = "123456:BENCHMARK-token"
+ADMIN_ID = 1
+os.environ.setdefault("USER_DB_PATH", os.path.join(BENCH_DIR, "users.db"))
+os.environ.setdefault("WEATHER_API_KEY", "bench")
+os.environ.setdefault("BROADCAST_RATE", "1000")
+os.environ["ADMIN_ID"] = str(ADMIN_ID)
+
+import requests
+from requests.adapters import BaseAdapter
+from telegram import Bot, Update
+from telegram.ext import Updater
+from telegram.utils.request import Request
+
+import main
+
+# --- FAKE TELEGRAM BOT API ---
+class _BotAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        api = self.server.api
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("application/json"): params = json.loads(body or b"{}")
+        else: params = dict(re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)\r\n', body))
+        params = {k.decode() if isinstance(k, bytes) else k: v.decode(errors="replace") if isinstance(v, bytes) else v
+                  for k, v in params.items()}
+        result = api.call(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200); self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload))); self.end_headers(); self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeBotAPI:
+    """Just enough of the Bot API for the handlers; every reply is reported to `on_reply(chat_id, method, text)`."""
+    def __init__(self, latency=0.0, on_reply=None):
+        self.latency, self.on_reply = latency, on_reply
+        self.calls = 0
+        self._message_ids = iter(range(1, 1 << 62))
+        self._lock = threading.Lock()
+        self._updates, self._updates_ready = [], threading.Condition()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), _BotAPIRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.api = self
+        threading.Thread(target=self._httpd.serve_forever, name="fake-bot-api", daemon=True).start()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._httpd.server_port}/bot"
+
+    def push_update(self, data):
+        with self._updates_ready: self._updates.append(data); self._updates_ready.notify_all()
+
+    def _get_updates(self, params):
+        offset, deadline = int(params.get("offset") or 0), time.monotonic() + float(params.get("timeout") or 0)
+        with self._updates_ready:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline: self._updates_ready.wait(deadline - time.monotonic())
+            return list(self._updates[:100])
+
+    def call(self, method, params):
+        if method == "getUpdates": return self._get_updates(params)
+        if self.latency: time.sleep(self.latency)
+        with self._lock: self.calls += 1; message_id = next(self._message_ids)
+        if method == "getMe":
+            return {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("deleteWebhook", "setWebhook", "answerCallbackQuery"): return True
+        chat_id = int(params.get("chat_id") or 0)
+        text = params.get("text") or params.get("caption") or ""
+        if self.on_reply: self.on_reply(chat_id, method, text)
+        message = {"message_id": int(params.get("message_id") or message_id), "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}, "text": text}
+        if method == "sendPhoto": message["photo"] = [{"file_id": f"photo-{message_id}", "file_unique_id": str(message_id), "width": 1, "height": 1}]
+        if method == "sendAudio": message["audio"] = {"file_id": f"audio-{message_id}", "file_unique_id": str(message_id), "duration": 1}
+        return message
+
+    def close(self):
+        self._httpd.shutdown(); self._httpd.server_close()
+
+# --- STUB UPSTREAMS ---
+class StubAdapter(BaseAdapter):
+    """requests transport adapter answering with canned payloads after `latency` seconds, failing `error_rate` of calls."""
+    def __init__(self, payload, latency, error_rate):
+        super().__init__()
+        self.payload, self.latency, self.error_rate = payload, latency, error_rate
+
+    def send(self, request, **kwargs):
+        time.sleep(self.latency)
+        res = requests.Response()
+        res.request, res.url = request, request.url
+        if random.random() < self.error_rate:
+            res.status_code, res._content = 503, b"stub outage"
+        else:
+            body = self.payload(request.url)
+            res.status_code, res._content = 200, body if isinstance(body, bytes) else json.dumps(body).encode()
+        return res
+
+    def close(self):
+        pass
+
+UPSTREAM_PAYLOADS = {
+    "http://ip-api.com/": lambda url: {"status": "success", "country": "Benchland", "regionName": "Region", "city": "City",
+                                       "zip": "0000", "lat": 1.0, "lon": 2.0, "isp": "Bench ISP", "org": "Bench Org"},
+    "https://api.github.com/": lambda url: {"login": url.rsplit("/", 1)[-1], "name": "Bench User", "bio": "-", "followers": 1,
+                                            "following": 2, "public_repos": 3, "html_url": "https://github.com/bench",
+                                            "avatar_url": f"https://avatars.example/{url.rsplit('/', 1)[-1]}.png"},
+    "http://api.openweathermap.org/": lambda url: {"cod": 200, "name": "City", "sys": {"country": "BL"},
+                                                   "weather": [{"description": "clear sky"}], "main": {"temp": 21, "humidity": 40}},
+    "http://tinyurl.com/": lambda url: b"https://tinyurl.com/bench",
+    "https://hastebin.com/": lambda url: {"key": "bench"},
+    "https://lookup.binlist.net/": lambda url: {"bank": {"name": "Bench Bank"}, "country": {"name": "Benchland"},
+                                                "type": "debit", "scheme": "visa"},
+}
+
+def install_stubs(latency, error_rate):
+    """Point main.py's HTTP session and heavy libraries at in-process stand-ins."""
+    for prefix, payload in UPSTREAM_PAYLOADS.items():
+        main.HTTP_SESSION.mount(prefix, StubAdapter(payload, latency, error_rate))
+
+    def maybe_fail(what):
+        time.sleep(latency)
+        if random.random() < error_rate: raise RuntimeError(f"stub {what} outage")
+
+    class FakeTTS:
+        def __init__(self, text, lang): self.text = text
+        def write_to_fp(self, fp): maybe_fail("gtts"); fp.write(b"\xff\xfb" + self.text.encode() * 20)
+
+    class FakeYoutubeDL:
+        def __init__(self, opts): pass
+        def __enter__(self): return self
+        def __exit__(self, *exc): return False
+        def extract_info(self, url, download=False):
+            maybe_fail("yt-dlp")
+            return {"title": "Bench video", "duration": 212,
+                    "formats": [{"format_note": f"{q}p", "filesize": q * 100000, "url": f"https://cdn.example/{q}"} for q in (144, 240, 360, 480, 720, 1080)]}
+
+    def fake_whois(domain):
+        maybe_fail("whois")
+        return SimpleNamespace(registrar="Bench Registrar", creation_date="2001-01-01", expiration_date="2031-01-01",
+                               name_servers=["ns1.bench.example", "ns2.bench.example"])
+
+    class FakeTranslator:
+        def translate(self, text, dest):
+            # googletrans 4.0.0-rc1 translates a list one item (and one request) at a time
+            if isinstance(text, list): return [self.translate(t, dest) for t in text]
+            maybe_fail("googletrans")
+            return SimpleNamespace(text=text[::-1])
+
+    main.gtts = SimpleNamespace(gTTS=FakeTTS)
+    main.yt_dlp = SimpleNamespace(YoutubeDL=FakeYoutubeDL)
+    main.whois = SimpleNamespace(whois=fake_whois)
+    main.googletrans = SimpleNamespace(Translator=FakeTranslator)
+    # The stubs only exist in this process, so extraction runs on threads instead of the process pool.
+    main.YT_EXECUTOR = ThreadPoolExecutor(max_workers=main.YT_WORKERS, thread_name_prefix="yt-bench")
+
+# --- WORKLOAD ---
+ARGUMENTS = {
+    "ip": lambda i: f"10.0.{i // 256}.{i % 256}",
+    "github": lambda i: f"user{i}",
+    "weather": lambda i: f"city{i}",
+    "whois": lambda i: f"domain{i}.example",
+    "qr": lambda i: f"https://example.com/{i}",
+    "tts": lambda i: f"en This is sentence number {i}. It is followed by a second one. And a third sentence for good measure.",
+    "yt": lambda i: f"https://youtu.be/{i:011d}",
+    "tr": lambda i: f"bn phrase number {i}",
+    "short": lambda i: f"https://example.com/{i}",
+    "paste": lambda i: f"paste body {i}",
+    "bin": lambda i: "457382",
+    "ping": lambda i: "",
+    "broadcast": lambda i: f"Benchmark broadcast {i}",
+}
+PHASE_LIMITS = {"broadcast": 5}  # each one fans out to --broadcast-users sends
+PLACEHOLDERS = ("⏳ Fetching video info...", "⏳ Generating cards...", "Broadcasting")
+ADMISSION_TEXTS = tuple(main.REJECTION_TEXTS.values())  # counted in METRICS; lane-full replies are not
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        command, _, weight = part.partition("=")
+        if command not in ARGUMENTS: raise SystemExit(f"Unknown command in --mix: {command}")
+        mix[command] = float(weight or 1)
+    return mix
+
+def make_update(update_id, chat_id, user_id, command, argument):
+    text = f"/{command} {argument}".strip()
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Bench"},
+        "entities": [{"type": "bot_command", "offset": 0, "length": len(command) + 1}]}}
+
+class Tracker:
+    """Matches Bot API replies to the synthetic update that caused them (one unique chat per update)."""
+    def __init__(self):
+        self.pending, self.results = {}, {}
+        self._lock, self._idle = threading.Lock(), threading.Condition()
+
+    def expect(self, chat_id, command):
+        with self._lock: self.pending[chat_id] = (command, time.perf_counter())
+
+    def on_reply(self, chat_id, method, text):
+        with self._lock:
+            entry = self.pending.get(chat_id)
+            if entry is None: return  # broadcast recipients and other untracked chats
+            command, started = entry
+            if command == "broadcast" and not text.startswith(("Broadcast sent", main.LANE_BUSY_TEXT) + ADMISSION_TEXTS): return
+            if command != "broadcast" and method == "sendMessage" and text.startswith(PLACEHOLDERS): return
+            del self.pending[chat_id]
+            outcome = ("rejected" if text in ADMISSION_TEXTS else "busy" if text == main.LANE_BUSY_TEXT
+                       else "error" if "error" in text.lower() or text.startswith("Could not") else "ok")
+            self.results[chat_id] = (command, time.perf_counter() - started, outcome)
+        with self._idle: self._idle.notify_all()
+
+    def wait(self, timeout, silent=lambda: 0):
+        """Wait until every update was answered or is accounted for by `silent()` unanswered rejections."""
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while len(self.pending) > silent() and time.monotonic() < deadline: self._idle.wait(min(0.1, deadline - time.monotonic()))
+        return len(self.pending)
+
+def rejected_counts():
+    """Admission rejections so far per command, whether or not the user was sent a notice."""
+    counts = Counter()
+    with main.METRICS._lock:
+        for (kind, command), v in main.METRICS.counters.items():
+            if kind.startswith("rejected_"): counts[command] += v
+    return counts
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else float("nan")
+
+def rss_kb():
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError): return 0
+
+# --- RUNNER ---
+class Bench:
+    def __init__(self, args):
+        self.args, self.tracker = args, Tracker()
+        self.api = FakeBotAPI(latency=args.api_latency, on_reply=self.tracker.on_reply)
+        install_stubs(args.upstream_latency, args.error_rate)
+        con_pool_size = sum(lane.workers for lane in main.LANES.values()) + main.REPLY_WORKERS + 4
+        bot = Bot(BENCH_TOKEN, base_url=self.api.base_url, request=Request(con_pool_size=con_pool_size))
+        self.updater = Updater(bot=bot, use_context=True, workers=main.env_int("DISPATCHER_WORKERS", 4))
+        main.register_handlers(self.updater.dispatcher)
+        self.next_id, self.next_chat = 1, 10 ** 9
+        self.server = self.webhook = None
+        if args.transport == "polling":
+            self.updater.start_polling(poll_interval=0, timeout=10)
+        elif args.transport == "webhook":
+            self.server = main.WebhookServer(self.updater.dispatcher, "127.0.0.1", 0, "/telegram", "bench-secret")
+            self.server.start()
+            self.webhook = requests.Session()
+        else:
+            threading.Thread(target=self.updater.dispatcher.start, name="dispatcher", daemon=True).start()
+        for user_id in range(2, args.broadcast_users + 2):
+            main.USER_STORE.touch(SimpleNamespace(id=user_id, first_name="Bench", username=None))
+        main.USER_STORE.flush()
+
+    def submit(self, command, argument):
+        update_id, chat_id = self.next_id, self.next_chat
+        self.next_id += 1; self.next_chat += 1
+        user_id = ADMIN_ID if command == "broadcast" else 1000 + random.randrange(self.args.users)
+        data = make_update(update_id, chat_id, user_id, command, argument)
+        self.tracker.expect(chat_id, command)
+        if self.args.transport == "polling": self.api.push_update(data)
+        elif self.args.transport == "webhook":
+            self.webhook.post(f"http://127.0.0.1:{self.server._httpd.server_port}/telegram", json=data,
+                              headers={"X-Telegram-Bot-Api-Secret-Token": "bench-secret"})
+        else: self.updater.dispatcher.update_queue.put(Update.de_json(data, self.updater.bot))
+
+    def run_phase(self, name, mix, count):
+        """Replay `count` updates drawn from `mix`; returns per-command stats for this phase."""
+        commands, weights = zip(*mix.items())
+        self.tracker.results.clear()
+        if self.args.trace_memory: tracemalloc.reset_peak(); traced_before = tracemalloc.get_traced_memory()[0]
+        rss_before, rejected_before, started = rss_kb(), rejected_counts(), time.perf_counter()
+        for _ in range(count):
+            command = random.choices(commands, weights)[0]
+            self.submit(command, ARGUMENTS[command](random.randrange(self.args.distinct_args)))
+            if self.args.rate: time.sleep(1 / self.args.rate)
+        def shed():
+            """Admission rejections per command that got no notice, so will never be answered."""
+            notices = Counter(r[0] for r in list(self.tracker.results.values()) if r[2] == "rejected")
+            return rejected_counts() - rejected_before - notices
+        unanswered = self.tracker.wait(self.args.timeout, lambda: sum(shed().values()))
+        elapsed = time.perf_counter() - started
+        memory = (tracemalloc.get_traced_memory()[1] - traced_before) // 1024 if self.args.trace_memory else rss_kb() - rss_before
+        pending, self.tracker.pending, silent = self.tracker.pending, {}, shed()
+        lost = unanswered - sum(silent.values())
+        if lost > 0: print(f"[{name}] {lost} updates got no reply within {self.args.timeout}s", file=sys.stderr)
+        rows = {}
+        for command in commands:
+            results = [r for r in self.tracker.results.values() if r[0] == command]
+            latencies = [r[1] for r in results if r[2] not in ("busy", "rejected")]
+            unanswered = sum(c == command for c, _ in pending.values())
+            rows[command] = {"count": len(results), "ok": sum(r[2] == "ok" for r in results),
+                             "busy": sum(r[2] in ("busy", "rejected") for r in results), "errors": sum(r[2] == "error" for r in results),
+                             "shed": min(silent[command], unanswered), "dropped": max(0, unanswered - silent[command]),
+                             "p50_ms": percentile(latencies, 0.5) * 1000, "p99_ms": percentile(latencies, 0.99) * 1000}
+        total = sum(row["count"] for row in rows.values())
+        return {"phase": name, "updates": count, "completed": total, "seconds": elapsed,
+                "throughput": total / elapsed if elapsed else 0.0, "memory_kb": memory, "commands": rows}
+
+    def close(self):
+        if self.server: self.server.stop()
+        elif self.args.transport == "polling": self.updater.stop()
+        else: self.updater.dispatcher.stop()
+        main.BROADCASTER.stop()
+        self.api.close()
+
+def print_phase(result):
+    print(f"\n== {result['phase']}: {result['completed']}/{result['updates']} replies in {result['seconds']:.2f}s "
+          f"({result['throughput']:.1f} updates/s, memory {result['memory_kb']:+d} KB)")
+    print(f"{'command':<10}{'count':>7}{'ok':>7}{'busy':>6}{'shed':>6}{'dropped':>9}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for command, row in result["commands"].items():
+        print(f"{command:<10}{row['count']:>7}{row['ok']:>7}{row['busy']:>6}{row['shed']:>6}{row['dropped']:>9}{row['errors']:>8}"
+              f"{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+def find_regressions(results, baseline, tolerance):
+    """Compare p99 latency and throughput with a previous --json run."""
+    previous = {r["phase"]: r for r in baseline}
+    problems = []
+    for result in results:
+        old = previous.get(result["phase"])
+        if not old: continue
+        if result["throughput"] < old["throughput"] * (1 - tolerance):
+            problems.append(f"{result['phase']}: throughput {old['throughput']:.1f} -> {result['throughput']:.1f} updates/s")
+        for command, row in result["commands"].items():
+            old_row = old["commands"].get(command)
+            if old_row and row["p99_ms"] > old_row["p99_ms"] * (1 + tolerance):
+                problems.append(f"{result['phase']}/{command}: p99 {old_row['p99_ms']:.1f} -> {row['p99_ms']:.1f} ms")
+    return problems
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the Ultimate Toolkit Bot.")
+    parser.add_argument("--mix", default="ip=3,github=2,weather=1,whois=1,qr=2,tts=1,yt=1,tr=1,ping=3,broadcast=0.05",
+                        help="comma-separated command=weight pairs for the mixed phase")
+    parser.add_argument("--updates", type=int, default=300, help="updates per phase")
+    parser.add_argument("--per-command", action="store_true", help="also run one isolated phase per command in --mix")
+    parser.add_argument("--rate", type=float, default=0, help="updates per second to inject (0 = as fast as possible)")
+    parser.add_argument("--transport", choices=("queue", "webhook", "polling"), default="queue")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds added to each Bot API call")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="seconds added to each upstream call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--distinct-args", type=int, default=50, help="argument cardinality; lower means more cache hits")
+    parser.add_argument("--users", type=int, default=100, help="distinct synthetic senders")
+    parser.add_argument("--broadcast-users", type=int, default=500, help="registered users each /broadcast reaches")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for outstanding replies per phase")
+    parser.add_argument("--trace-memory", action="store_true", help="report tracemalloc peak instead of RSS growth (slower)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="previous --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    if args.trace_memory: tracemalloc.start()
+    mix = parse_mix(args.mix)
+    bench = Bench(args)
+    results = []
+    try:
+        phases = [(f"only-{command}", {command: 1}) for command in mix] if args.per_command else []
+        for name, phase_mix in phases + [("mixed", mix)]:
+            count = min(args.updates, PHASE_LIMITS.get(name[len("only-"):], args.updates)) if name.startswith("only-") else args.updates
+            results.append(bench.run_phase(name, phase_mix, count))
+            print_phase(results[-1])
+    finally:
+        bench.close()
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f: problems = find_regressions(results, json.load(f), args.max_regression)
+        for problem in problems: print(f"REGRESSION {problem}", file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
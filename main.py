@@ -3,14 +3,40 @@
 # ================================================================= #
 
 # -- IMPORTS --
+import time
+BOOT_STARTED = time.perf_counter()
 import os
+import hmac
+import secrets
+import hashlib
+import json
+import signal
 import logging
+import re
+import queue
 import random
+import tempfile
+import multiprocessing
+import sqlite3
+import threading
+import bisect
+import functools
+import importlib
 import requests
-import qrcode
 from io import BytesIO
-from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from itertools import islice
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from telegram import Update, Bot, ParseMode, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+from telegram.utils.request import Request
 from telegram.ext import (
     Updater,
     CommandHandler,
@@ -20,11 +46,8 @@ from telegram.ext import (
     MessageHandler,
     Filters,
 )
-from googletrans import Translator
-import yt_dlp
-from gtts import gTTS
-import phonenumbers
-import whois
+
+# Heavy, command-specific libraries are imported on first use (see LazyModule).
 
 # -- BOT SETUP --
 START_TIME = datetime.utcnow()
@@ -33,14 +56,20 @@ try:
 except (ValueError, TypeError):
     ADMIN_ID = 0
 
-# In-memory storage (will reset on bot restart)
-ALL_USER_IDS = set()
 FEEDBACK_STATE = 0
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- HELPER & ADMIN FUNCTIONS ---
+def env_int(name, default):
+    try: return int(os.environ.get(name, default))
+    except (ValueError, TypeError): return default
+
+def env_float(name, default):
+    try: return float(os.environ.get(name, default))
+    except (ValueError, TypeError): return default
+
 def get_uptime():
     delta = datetime.utcnow() - START_TIME
     days, rem = divmod(delta.total_seconds(), 86400)
@@ -58,11 +87,992 @@ def restricted(func):
         return func(update, context, *args, **kwargs)
     return wrapped
 
+class LazyModule:
+    """Module stand-in that performs the real import on first attribute access."""
+    def __init__(self, name, submodules=()):
+        self._name, self._submodules, self._module = name, submodules, None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    for sub in self._submodules: importlib.import_module(f"{self._name}.{sub}")
+                    logger.info(f"Imported {self._name} in {(time.perf_counter() - started) * 1000:.0f}ms")
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+yt_dlp = LazyModule("yt_dlp")
+gtts = LazyModule("gtts")
+googletrans = LazyModule("googletrans")
+whois = LazyModule("whois")
+phonenumbers = LazyModule("phonenumbers", submodules=("carrier", "timezone"))
+qrcode = LazyModule("qrcode")
+LAZY_MODULES = (yt_dlp, gtts, googletrans, whois, phonenumbers, qrcode)
+
+def preload_yt_dlp():
+    """Runs in a YT_EXECUTOR worker, so its first /yt does not pay for importing yt_dlp."""
+    yt_dlp.load()
+
+def warm_up():
+    """Import the lazy libraries and start the /yt workers in the background once the bot is serving.
+
+    yt_dlp is only ever used by the workers, so it is imported there and not in the bot process.
+    """
+    def run():
+        started = time.perf_counter()
+        for module in LAZY_MODULES:
+            if module is yt_dlp: continue
+            try: module.load()
+            except ImportError: logger.warning(f"Warm-up could not import {module._name}")
+        # Workers are spawned on demand, one per job submitted while none is idle, so start them all at once.
+        for future in [YT_EXECUTOR.submit(preload_yt_dlp) for _ in range(YT_WORKERS)]:
+            try: future.result()
+            except ImportError: logger.warning("Warm-up could not import yt_dlp in a /yt worker")
+        logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+
+class StartupTimer:
+    """Collects the duration of each boot phase for a single summary log line."""
+    def __init__(self, started):
+        self.started = self._last = started
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.perf_counter(); self.phases.append((phase, now - self._last)); self._last = now
+
+    def report(self):
+        phases = ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.phases)
+        logger.info(f"Startup timing: {phases} (total {(self._last - self.started) * 1000:.0f}ms)")
+
+# --- METRICS ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    """Fixed-bucket latency histogram (seconds), cheap enough to update on every call."""
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total, self.sum = 0, 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += 1; self.sum += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf when it falls in the overflow bucket)."""
+        rank, seen = q * self.total, 0
+        for bound, count in zip(LATENCY_BUCKETS + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank: return bound
+        return float("inf")
+
+class Metrics:
+    """Latency histograms, error counts and in-flight gauges keyed by (kind, name), e.g. ("handler", "yt")."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.errors = Counter()
+        self.in_flight = Counter()
+        self.counters = Counter()
+
+    def observe(self, kind, name, seconds, failed=False):
+        with self._lock:
+            hist = self.latency.get((kind, name)) or self.latency.setdefault((kind, name), Histogram())
+            hist.observe(seconds)
+            if failed: self.errors[(kind, name)] += 1
+
+    def begin(self, kind, name):
+        """Count a call as in flight and return `finish(failed=False)`, which records it; for calls that end elsewhere."""
+        with self._lock: self.in_flight[(kind, name)] += 1
+        started = time.perf_counter()
+        def finish(failed=False):
+            with self._lock: self.in_flight[(kind, name)] -= 1
+            self.observe(kind, name, time.perf_counter() - started, failed)
+        return finish
+
+    @contextmanager
+    def track(self, kind, name):
+        finish, failed = self.begin(kind, name), True
+        try:
+            yield
+            failed = False
+        finally:
+            finish(failed)
+
+    def error(self, kind, name):
+        with self._lock: self.errors[(kind, name)] += 1
+
+    def incr(self, kind, name, n=1):
+        with self._lock: self.counters[(kind, name)] += n
+
+METRICS = Metrics()
+GAUGES = {}  # name -> zero-argument callable, filled in by main()
+
+def instrumented(name, func):
+    """Record latency, errors and in-flight count of handler `func` under `name`.
+
+    Handlers that reply from a Future return it, and are timed until it completes
+    rather than until they return.
+    """
+    @functools.wraps(func)
+    def wrapped(update, context, *args, **kwargs):
+        finish = METRICS.begin("handler", name)
+        try: result = func(update, context, *args, **kwargs)
+        except BaseException: finish(failed=True); raise
+        if isinstance(result, Future): result.add_done_callback(lambda f: finish(f.cancelled() or f.exception() is not None))
+        else: finish()
+        return result
+    return wrapped
+
+# --- HTTP CLIENT ---
+# One pooled session for every upstream: keep-alive per host, bounded retries
+# with backoff, and a (connect, read) timeout so a slow API can't hang a worker.
+HTTP_TIMEOUT = (env_float("HTTP_CONNECT_TIMEOUT", 3.05), env_float("HTTP_READ_TIMEOUT", 10))
+HTTP_RETRIES = env_int("HTTP_RETRIES", 2)
+HTTP_POOL_SIZE = env_int("HTTP_POOL_SIZE", 16)
+
+def _build_http_session():
+    retry = Retry(total=HTTP_RETRIES, connect=HTTP_RETRIES, read=HTTP_RETRIES, backoff_factor=0.3,
+                  status_forcelist=(500, 502, 503, 504), allowed_methods=frozenset({"GET", "HEAD"}),
+                  respect_retry_after_header=False, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter); session.mount("https://", adapter)
+    session.headers["User-Agent"] = "UltimateToolkitBot/1.0"
+    return session
+
+HTTP_SESSION = _build_http_session()
+HTTP_EXECUTOR = ThreadPoolExecutor(max_workers=env_int("HTTP_WORKERS", HTTP_POOL_SIZE), thread_name_prefix="http")
+
+UPSTREAMS = {"ip-api.com": "ip-api", "api.github.com": "github", "api.openweathermap.org": "openweathermap",
+             "tinyurl.com": "tinyurl", "hastebin.com": "hastebin", "lookup.binlist.net": "binlist"}
+
+def http_request(method, url, **kwargs):
+    """Blocking request through the shared pooled session."""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    host = urlsplit(url).hostname
+    upstream = UPSTREAMS.get(host, host)
+    with METRICS.track("upstream", upstream):
+        res = HTTP_SESSION.request(method, url, **kwargs)
+    if res.status_code == 429 or res.status_code >= 500: METRICS.error("upstream", upstream)
+    return res
+
+def http_request_async(method, url, **kwargs):
+    """Run `http_request` on the HTTP pool and return its Future, so the calling handler can return at once."""
+    return HTTP_EXECUTOR.submit(http_request, method, url, **kwargs)
+
+# Replies to Telegram get their own pool, so they never queue behind slow upstream fetches.
+REPLY_WORKERS = env_int("REPLY_WORKERS", 8)
+REPLY_EXECUTOR = ThreadPoolExecutor(max_workers=REPLY_WORKERS, thread_name_prefix="reply")
+
+def _settle(target, callback, source):
+    try: target.set_result(callback(source))
+    except Exception as e: target.set_exception(e)
+
+def then(future, callback, executor=None):
+    """Run `callback(future)` once `future` is done and return a Future of the callback's result.
+
+    The callback gets its own job on `executor` (REPLY_EXECUTOR by default), so replies to
+    users sharing one fetch go out in parallel instead of one by one on the thread that
+    finished it. An already finished `future` runs the callback inline.
+    """
+    chained = Future()
+    if future.done(): _settle(chained, callback, future)
+    else: future.add_done_callback(lambda f: (executor or REPLY_EXECUTOR).submit(_settle, chained, callback, f))
+    return chained
+
+def fetch_json(url, cacheable=(200, 404)):
+    """GET and decode `url`, raising on answers that must not be cached (rate limits, 5xx, bad keys)."""
+    res = http_request("GET", url)
+    if res.status_code not in cacheable: res.raise_for_status()
+    return res.json()
+
+# --- RESPONSE CACHE ---
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH")  # unset = memory only
+CACHES = {}
+
+def _resolved(value):
+    future = Future(); future.set_result(value)
+    return future
+
+class TTLCache:
+    """Bounded LRU cache with a per-entry TTL and stale-while-revalidate.
+
+    Entries younger than `ttl` are served as fresh; until `ttl + stale_ttl` they
+    are still served while a single background refresh runs. With `db_path` set,
+    entries are written through to SQLite (so values must be JSON-serialisable);
+    every maxsize/10 writes the table drops expired rows and all but the `maxsize`
+    newest, so the disk layer is bounded like the memory one.
+    """
+    def __init__(self, name, maxsize, ttl, stale_ttl=0, db_path=None):
+        self.name, self.maxsize, self.ttl, self.stale_ttl = name, maxsize, ttl, stale_ttl
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self._inflight = {}  # key -> Future of the running fetch
+        self._lock = threading.Lock()
+        self.hits = self.stale_hits = self.misses = self.evictions = self.refreshes = 0
+        self._db_path, self._db, self._writes = db_path, None, 0
+        self._db_lock = threading.Lock()
+        CACHES[name] = self
+
+    def _conn(self):
+        """Open the backing store on first use (callers hold `_db_lock`), so importing the module touches no files."""
+        if self._db is None:
+            self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS cache (name TEXT, key TEXT, value TEXT, stored_at REAL, PRIMARY KEY (name, key))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS cache_age ON cache (name, stored_at)")
+            self._trim(self._db)
+        return self._db
+
+    def _trim(self, db):
+        """Delete this cache's expired rows and all but its `maxsize` newest (callers hold `_db_lock`)."""
+        db.execute("DELETE FROM cache WHERE name = ? AND stored_at < ?", (self.name, time.time() - self.ttl - self.stale_ttl))
+        db.execute("DELETE FROM cache WHERE name = ?1 AND key IN (SELECT key FROM cache WHERE name = ?1 "
+                   "ORDER BY stored_at DESC LIMIT -1 OFFSET ?2)", (self.name, self.maxsize))
+        db.commit()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._data[key] = entry; self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False); self.evictions += 1
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry: self._data.move_to_end(key); return entry
+        if not self._db_path: return None
+        with self._db_lock:
+            row = self._conn().execute("SELECT stored_at, value FROM cache WHERE name = ? AND key = ?", (self.name, key)).fetchone()
+        if not row: return None
+        entry = (row[0], json.loads(row[1])); self._remember(key, entry)
+        return entry
+
+    def set(self, key, value):
+        entry = (time.time(), value); self._remember(key, entry)
+        if self._db_path:
+            with self._db_lock:
+                db = self._conn()
+                db.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (self.name, key, json.dumps(value), entry[0]))
+                db.commit()
+                self._writes += 1
+                if self._writes % max(1, self.maxsize // 10) == 0: self._trim(db)
+
+    def get(self, key):
+        """Return the cached value without fetching, or None when missing or fully expired."""
+        entry = self._lookup(key)
+        with self._lock:
+            if entry and time.time() - entry[0] < self.ttl + self.stale_ttl: self.hits += 1; return entry[1]
+            self.misses += 1
+        return None
+
+    def get_async(self, key, fetch, executor=None):
+        """Return a Future for `key`; `fetch()` only runs (on `executor`) on a miss or a stale hit."""
+        entry = self._lookup(key)
+        age = time.time() - entry[0] if entry else None
+        if entry and age < self.ttl:
+            with self._lock: self.hits += 1
+            return _resolved(entry[1])
+        if entry and age < self.ttl + self.stale_ttl:
+            with self._lock: self.stale_hits += 1
+            try: self._fetch(key, fetch, executor, refresh=True)
+            except Exception: logger.info(f"Skipped refreshing {self.name} entry; executor is full")  # the stale value still goes out
+            return _resolved(entry[1])
+        with self._lock: self.misses += 1
+        return self._fetch(key, fetch, executor)
+
+    def _fetch(self, key, fetch, executor, refresh=False):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future: return future
+            if refresh: self.refreshes += 1
+            future = self._inflight[key] = (executor or HTTP_EXECUTOR).submit(fetch)
+        def settle(f):
+            try:
+                if not f.cancelled() and f.exception() is None: self.set(key, f.result())
+            finally:
+                with self._lock: self._inflight.pop(key, None)
+        future.add_done_callback(settle)
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "stale_hits": self.stale_hits, "misses": self.misses,
+                    "evictions": self.evictions, "refreshes": self.refreshes}
+
+def _lookup_cache(name, maxsize, ttl, stale_ttl):
+    """Build a lookup cache whose limits can be tuned with CACHE_<NAME>_SIZE/_TTL/_STALE."""
+    prefix = f"CACHE_{name.upper()}"
+    return TTLCache(name, env_int(f"{prefix}_SIZE", maxsize), env_float(f"{prefix}_TTL", ttl),
+                    env_float(f"{prefix}_STALE", stale_ttl), db_path=CACHE_DB_PATH)
+
+IP_CACHE = _lookup_cache("ip", 4096, 6 * 3600, 24 * 3600)
+GITHUB_CACHE = _lookup_cache("github", 2048, 30 * 60, 6 * 3600)
+WEATHER_CACHE = _lookup_cache("weather", 1024, 10 * 60, 20 * 60)
+WHOIS_CACHE = _lookup_cache("whois", 2048, 12 * 3600, 36 * 3600)
+
+# --- USER REGISTRY ---
+USER_DB_PATH = os.environ.get("USER_DB_PATH", "users.db")
+
+class UserStore:
+    """Persistent SQLite (WAL) registry of everyone who has used the bot.
+
+    Writes are queued and flushed in batches by a background thread so handlers
+    never touch the disk; the database is only opened on first use and reads
+    page through it by primary key instead of loading every row.
+    """
+    def __init__(self, path, flush_interval=1.0, batch_size=500):
+        self.path, self.flush_interval, self.batch_size = path, flush_interval, batch_size
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writer = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self._lock:
+                if self._conn is None:
+                    conn = sqlite3.connect(self.path, check_same_thread=False)
+                    conn.execute("PRAGMA journal_mode=WAL"); conn.execute("PRAGMA synchronous=NORMAL")
+                    conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_name TEXT, username TEXT, "
+                                 "first_seen REAL, last_seen REAL, blocked INTEGER NOT NULL DEFAULT 0)")
+                    conn.commit()
+                    self._conn = conn
+        return self._conn
+
+    def _enqueue(self, item):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="user-store", daemon=True)
+                    self._writer.start()
+        self._queue.put(item)
+
+    def touch(self, user):
+        """Record that `user` is alive; clears a previous blocked flag."""
+        self._enqueue(("seen", (user.id, user.first_name, user.username, time.time())))
+
+    def mark_blocked(self, user_id, blocked=True):
+        self._enqueue(("blocked", (int(blocked), user_id)))
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try: batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty: break
+            try: self._apply([item for item in batch if item is not None])
+            except Exception: logger.exception("Failed to write %d user updates", len(batch))
+            for _ in batch: self._queue.task_done()
+            if batch[-1] is None: return
+
+    def _apply(self, batch):
+        conn = self.conn
+        with self._lock:
+            for kind, row in batch:
+                if kind == "seen":
+                    conn.execute("INSERT INTO users (user_id, first_name, username, first_seen, last_seen) VALUES (?, ?, ?, ?, ?4) "
+                                 "ON CONFLICT(user_id) DO UPDATE SET first_name = excluded.first_name, "
+                                 "username = excluded.username, last_seen = excluded.last_seen, blocked = 0", row)
+                else:
+                    conn.execute("UPDATE users SET blocked = ? WHERE user_id = ?", row)
+            conn.commit()
+
+    def iter_active_ids(self, after=0, page_size=1000):
+        """Yield ids of users who have not blocked the bot, ascending, one page per query."""
+        while True:
+            conn = self.conn
+            with self._lock:
+                rows = conn.execute("SELECT user_id FROM users WHERE blocked = 0 AND user_id > ? ORDER BY user_id LIMIT ?",
+                                    (after, page_size)).fetchall()
+            if not rows: return
+            for (user_id,) in rows: yield user_id
+            after = rows[-1][0]
+
+    def count(self):
+        conn = self.conn
+        with self._lock:
+            return conn.execute("SELECT COUNT(*), COALESCE(SUM(blocked), 0) FROM users").fetchone()
+
+    def flush(self):
+        if self._writer is not None: self._queue.join()
+
+    def close(self):
+        if self._writer is not None: self._queue.put(None); self._writer.join()
+        if self._conn is not None: self._conn.close()
+
+USER_STORE = UserStore(USER_DB_PATH)
+
+# --- MEDIA CACHE ---
+# Telegram keeps every uploaded file; re-sending its file_id skips both rendering and upload.
+MEDIA_CACHE = TTLCache("media", env_int("MEDIA_CACHE_SIZE", 4096), env_float("MEDIA_CACHE_TTL", 30 * 86400),
+                       db_path=CACHE_DB_PATH or USER_DB_PATH)
+
+def media_key(*parts):
+    return hashlib.sha256("\0".join(map(str, parts)).encode()).hexdigest()
+
+def reply_cached_media(key, send, render):
+    """Call `send` with the cached file_id for `key`, or with `render()` on a miss, caching the new upload's file_id."""
+    file_id = MEDIA_CACHE.get(key)
+    if file_id:
+        try: return send(file_id)
+        except BadRequest: logger.info("Cached file_id was rejected, uploading again")
+    message = send(render())
+    media = message.photo[-1] if message.photo else (message.audio or message.voice or message.document)
+    if media: MEDIA_CACHE.set(key, media.file_id)
+    return message
+
+# --- TEXT-TO-SPEECH PIPELINE ---
+# Long texts are cut into sentences that are synthesised concurrently and cached
+# one by one, then written in order to a file so memory stays flat.
+TTS_CHUNK_CHARS = env_int("TTS_CHUNK_CHARS", 200)
+TTS_WORKERS = env_int("TTS_WORKERS", 4)
+TTS_EXECUTOR = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+TTS_CHUNK_CACHE = TTLCache("tts_chunks", env_int("TTS_CHUNK_CACHE_SIZE", 512), env_float("TTS_CHUNK_CACHE_TTL", 7 * 86400))
+
+def split_tts_chunks(text, limit=TTS_CHUNK_CHARS):
+    """Split `text` into normalised sentences, hard-wrapping any longer than `limit` at a word boundary."""
+    chunks = []
+    for sentence in re.split(r"(?<=[.!?;:。！？])\s+", " ".join(text.split())):
+        while len(sentence) > limit:
+            cut = sentence.rfind(" ", 0, limit) + 1 or limit
+            chunks.append(sentence[:cut].strip()); sentence = sentence[cut:]
+        chunks.append(sentence.strip())
+    return [chunk for chunk in chunks if chunk]
+
+def synthesize_chunk(lang, text):
+    fp = BytesIO()
+    with METRICS.track("upstream", "gtts"): gtts.gTTS(text=text, lang=lang).write_to_fp(fp)
+    return fp.getvalue()
+
+def synthesize_speech(lang, text, out):
+    """Write MP3 speech for `text` to the binary file `out`, keeping at most 2 * TTS_WORKERS chunks in memory."""
+    lang, window = lang.lower(), deque()
+    for chunk in split_tts_chunks(text):
+        window.append(TTS_CHUNK_CACHE.get_async(f"{lang}\0{chunk}", functools.partial(synthesize_chunk, lang, chunk), TTS_EXECUTOR))
+        if len(window) >= 2 * TTS_WORKERS: out.write(window.popleft().result())
+    while window: out.write(window.popleft().result())
+
+# --- VIDEO METADATA ---
+# yt-dlp extraction is CPU-heavy, so it runs in worker processes and only the few
+# fields /yt prints are cached. Format URLs expire after a few hours, hence the short TTL.
+YT_WORKERS = env_int("YT_WORKERS", 2)
+YT_EXECUTOR_LOCK = threading.Lock()
+
+def _yt_executor():
+    return ProcessPoolExecutor(max_workers=YT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+YT_EXECUTOR = _yt_executor()
+YT_CACHE = _lookup_cache("yt", 1024, 3600, 2 * 3600)
+YT_MAX_LINKS = 7
+
+YT_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+
+def youtube_video_id(url):
+    """Video id of a youtube.com / youtu.be link, or None for anything else (other hosts are never rewritten)."""
+    parts = urlsplit(url if "://" in url else "//" + url)
+    host = (parts.hostname or "").lower()
+    if host == "youtu.be": candidate = parts.path[1:]
+    elif host == "youtube.com" or host.endswith(".youtube.com"):
+        segments = parts.path.strip("/").split("/")
+        if segments[0] in ("shorts", "embed", "live", "v") and len(segments) > 1: candidate = segments[1]
+        else: candidate = parse_qs(parts.query).get("v", [""])[0]
+    else: return None
+    return candidate if YT_ID.fullmatch(candidate) else None
+
+def extract_video_info(url):
+    """Runs in a YT_EXECUTOR process; returns only what /yt displays so the result is cheap to pickle and cache."""
+    ydl_opts = {'quiet': True, 'skip_download': True, 'force_generic_extractor': True, 'noplaylist': True}
+    try:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        raise RuntimeError(str(e)) from None  # yt-dlp errors carry unpicklable loggers
+    links = ({"note": f.get('format_note', 'video/audio'), "size": f['filesize'], "url": f['url']}
+             for f in info.get('formats', []) if f.get('filesize') and f.get('url'))
+    return {"title": info.get('title', 'N/A'), "duration": info.get('duration') or 0, "links": list(islice(links, YT_MAX_LINKS))}
+
+def replace_yt_executor(broken):
+    """Swap in a fresh pool once a dead worker has made `broken` unusable (no-op if another thread already did)."""
+    global YT_EXECUTOR
+    with YT_EXECUTOR_LOCK:
+        if YT_EXECUTOR is broken:
+            logger.warning("A yt-dlp worker died; starting a new process pool")
+            broken.shutdown(wait=False)
+            YT_EXECUTOR = _yt_executor()
+
+def fetch_video_info(url):
+    """Runs on a video lane thread and waits for the worker process, so the cache write and every
+    done callback happen on that thread instead of the process pool's result-collecting thread."""
+    with METRICS.track("upstream", "youtube"):
+        executor = YT_EXECUTOR
+        try: return executor.submit(extract_video_info, url).result()
+        except BrokenProcessPool: replace_yt_executor(executor)
+        return YT_EXECUTOR.submit(extract_video_info, url).result()
+
+def get_video_info(url):
+    """Future for the metadata of `url`; one extraction per video id, however many users ask at once."""
+    video_id = youtube_video_id(url)
+    if video_id: url = f"https://www.youtube.com/watch?v={video_id}"
+    return YT_CACHE.get_async(video_id or url, functools.partial(fetch_video_info, url), LANES["video"])  # may raise LaneFull
+
+# --- TRANSLATION SERVICE ---
+class TranslationService:
+    """googletrans behind a translation cache, on a few threads that each keep their own client.
+
+    googletrans sends one request per text (a list translate() just loops), so
+    nothing is batched: identical (language, text) requests share one in-flight
+    translation through the cache, and distinct texts run in parallel on the pool.
+    """
+    def __init__(self, cache, pool_size=2):
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="tr")
+        self._local = threading.local()
+
+    def translate_async(self, lang, text):
+        lang, text = lang.lower(), " ".join(text.split())
+        return self.cache.get_async(f"{lang}\0{text}", functools.partial(self._translate, lang, text), self.executor)
+
+    def _translate(self, lang, text):
+        client = getattr(self._local, "client", None)
+        if client is None: client = self._local.client = googletrans.Translator()  # if this raises, the next call retries
+        with METRICS.track("upstream", "googletrans"): return client.translate(text, dest=lang).text
+
+TRANSLATIONS = TranslationService(_lookup_cache("tr", 4096, 7 * 86400, 0), pool_size=env_int("TR_CLIENTS", 2))
+
+# --- BROADCAST ENGINE ---
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens per second up to `capacity`."""
+    def __init__(self, rate, capacity=None):
+        self.rate, self.capacity = rate, capacity or rate
+        self.tokens, self.updated, self.paused_until = self.capacity, time.monotonic(), 0.0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, cost):
+        """Take `cost` tokens and return 0, or return how long to wait before trying again. Caller holds the lock."""
+        now = time.monotonic()
+        if now < self.paused_until: return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate); self.updated = now
+        if self.tokens >= cost: self.tokens -= cost; return 0
+        return (cost - self.tokens) / self.rate
+
+    def try_acquire(self, cost=1):
+        with self._lock: return self._wait_time(cost) == 0
+
+    def acquire(self, cost=1):
+        while True:
+            with self._lock: wait = self._wait_time(cost)
+            if not wait: return
+            time.sleep(wait)
+
+    def refund(self, cost=1):
+        """Give back tokens taken for work that was not done after all."""
+        with self._lock: self.tokens = min(self.capacity, self.tokens + cost)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds` (e.g. after a flood-control RetryAfter)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens, self.updated = 0, self.paused_until  # refill starts when the pause ends, not from before it
+
+class Broadcaster:
+    """Sends broadcasts off the dispatcher, paced by a global token bucket.
+
+    Recipients are processed in id-ordered batches; the last id of every finished
+    batch is saved as the job cursor, so a crashed broadcast resumes where it stopped
+    (re-sending at most one batch). RetryAfter pauses the whole bucket, timeouts are
+    retried with backoff and chats that blocked the bot are flagged in USER_STORE.
+    """
+    def __init__(self, db_path, rate=25, workers=8, batch_size=200, max_attempts=3, progress_interval=3.0):
+        self.db_path, self.workers, self.batch_size = db_path, workers, batch_size
+        self.max_attempts, self.progress_interval = max_attempts, progress_interval
+        self.bucket = TokenBucket(rate)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="broadcast")
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._bot = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS broadcasts (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT, chat_id INTEGER, "
+                         "message_id INTEGER, cursor INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, "
+                         "failed INTEGER NOT NULL DEFAULT 0, blocked INTEGER NOT NULL DEFAULT 0, done INTEGER NOT NULL DEFAULT 0)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _sender(self, bot):
+        # A dedicated Bot with its own connection pool keeps broadcasts from starving handler replies.
+        if self._bot is None:
+            self._bot = Bot(bot.token, base_url=bot.base_url[:-len(bot.token)], request=Request(con_pool_size=self.workers + 2))
+        return self._bot
+
+    def start(self, bot, text, chat_id, message_id):
+        with self._lock:
+            job_id = self.conn.execute("INSERT INTO broadcasts (text, chat_id, message_id) VALUES (?, ?, ?)",
+                                       (text, chat_id, message_id)).lastrowid
+            self.conn.commit()
+        self._spawn(bot, {"id": job_id, "text": text, "chat_id": chat_id, "message_id": message_id,
+                          "cursor": 0, "sent": 0, "failed": 0, "blocked": 0})
+        return job_id
+
+    def resume(self, bot):
+        """Restart every broadcast that was still running when the bot last stopped."""
+        with self._lock:
+            cur = self.conn.execute("SELECT id, text, chat_id, message_id, cursor, sent, failed, blocked FROM broadcasts WHERE done = 0")
+            jobs = [dict(zip([c[0] for c in cur.description], row)) for row in cur.fetchall()]
+        for job in jobs:
+            logger.info("Resuming broadcast #%d after user %d", job["id"], job["cursor"])
+            self._spawn(bot, job)
+
+    def _spawn(self, bot, job):
+        threading.Thread(target=self._run, args=(self._sender(bot), job), name=f"broadcast-{job['id']}", daemon=True).start()
+
+    def _save(self, job, done=False):
+        with self._lock:
+            self.conn.execute("UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ?, done = ? WHERE id = ?",
+                              (job["cursor"], job["sent"], job["failed"], job["blocked"], int(done), job["id"]))
+            self.conn.commit()
+
+    def _report(self, bot, job, text):
+        try: bot.edit_message_text(text, chat_id=job["chat_id"], message_id=job["message_id"])
+        except Exception: pass  # "message is not modified" and friends must not stop the broadcast
+
+    def _run(self, bot, job):
+        total, blocked = USER_STORE.count()
+        recipients = USER_STORE.iter_active_ids(after=job["cursor"], page_size=self.batch_size)
+        last_report = time.monotonic()
+        while not self._stopping.is_set():
+            batch = list(islice(recipients, self.batch_size))
+            if not batch: break
+            for outcome in self._pool.map(lambda user_id: self._send(bot, user_id, job["text"]), batch):
+                job[outcome] += 1
+            job["cursor"] = batch[-1]; self._save(job)
+            if time.monotonic() - last_report >= self.progress_interval:
+                last_report = time.monotonic()
+                self._report(bot, job, f"Broadcasting... {job['sent'] + job['failed'] + job['blocked']}/{total - blocked} "
+                                       f"(sent {job['sent']}, blocked {job['blocked']}, failed {job['failed']})")
+        if self._stopping.is_set(): return
+        self._save(job, done=True)
+        self._report(bot, job, f"Broadcast sent to {job['sent']} users. Blocked: {job['blocked']}, failed: {job['failed']}.")
+
+    def _send(self, bot, user_id, text):
+        attempt = 0
+        while attempt < self.max_attempts:
+            self.bucket.acquire()
+            try:
+                bot.send_message(chat_id=user_id, text=text, parse_mode=ParseMode.MARKDOWN)
+                return "sent"
+            except RetryAfter as e:
+                self.bucket.pause(e.retry_after)
+            except Unauthorized:
+                USER_STORE.mark_blocked(user_id); return "blocked"
+            except BadRequest as e:
+                if "chat not found" in str(e).lower(): USER_STORE.mark_blocked(user_id); return "blocked"
+                logger.warning(f"Could not send to user {user_id}: {e}"); return "failed"
+            except NetworkError:
+                attempt += 1
+                if attempt < self.max_attempts: time.sleep(2 ** attempt)
+            except Exception:
+                logger.exception(f"Could not send to user {user_id}"); return "failed"
+        return "failed"
+
+    def stop(self):
+        self._stopping.set()
+
+BROADCASTER = Broadcaster(USER_DB_PATH, rate=env_float("BROADCAST_RATE", 25), workers=env_int("BROADCAST_WORKERS", 8),
+                          batch_size=env_int("BROADCAST_BATCH", 200))
+
+# --- COMMAND SCHEDULING ---
+# The dispatcher runs handlers one at a time, so anything slow is handed to a
+# bounded lane; commands without a lane stay inline on the fast path.
+class LaneFull(RuntimeError):
+    """Raised by Lane.submit when both the workers and the queue are taken."""
+
+class Lane:
+    """Bounded executor that runs at most `workers` jobs, queues `queue_size` more and rejects the rest.
+
+    It has the Executor `submit` signature, so blocking fetches can be given a
+    lane directly (e.g. `TTLCache.get_async(..., executor=lane)`).
+    """
+    def __init__(self, name, workers, queue_size):
+        self.name, self.workers, self.queue_size = name, workers, queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"lane-{name}")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self.pending = self.rejected = 0
+
+    def submit(self, fn, *args):
+        """Schedule `fn(*args)` and return its Future; raises LaneFull without running it when the lane is full."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock: self.rejected += 1
+            raise LaneFull(self.name)
+        with self._lock: self.pending += 1
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock: self.pending -= 1
+        self._slots.release()
+
+LANE_LIMITS = {"lookup": (8, 32), "media": (3, 6), "video": (YT_WORKERS, 4)}  # name: (workers, queue size)
+LANES = {name: Lane(name, env_int(f"LANE_{name.upper()}_WORKERS", w), env_int(f"LANE_{name.upper()}_QUEUE", q))
+         for name, (w, q) in LANE_LIMITS.items()}
+COMMAND_LANES = {  # handlers that block; yt and whois instead pass their lane to get_async
+    "gen": "lookup", "bin": "lookup", "rand": "lookup", "phone": "lookup",
+    "qr": "media", "tts": "media",
+}
+LANE_BUSY_TEXT = "⏳ Too many of these requests right now. Please try again in a minute."
+
+def _log_lane_failure(future):
+    if future.exception(): logger.error("Handler failed in lane", exc_info=future.exception())
+
+def scheduled(command, func):
+    """Run `func` on its command's lane, replying with a busy notice when that lane is full."""
+    lane = LANES.get(COMMAND_LANES.get(command))
+    if lane is None: return func
+    @functools.wraps(func)
+    def wrapped(update, context):
+        try: lane.submit(func, update, context).add_done_callback(_log_lane_failure)
+        except LaneFull: update.effective_message.reply_text(LANE_BUSY_TEXT)
+    return wrapped
+
+# --- METRICS EXPORT ---
+def _prometheus_labels(**labels):
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+def render_prometheus():
+    """Everything /stats knows, in Prometheus text exposition format."""
+    lines = []
+    with METRICS._lock:
+        latency = {key: (list(h.counts), h.total, h.sum) for key, h in METRICS.latency.items()}
+        errors, in_flight, counters = dict(METRICS.errors), dict(METRICS.in_flight), dict(METRICS.counters)
+    for kind in ("handler", "upstream"):
+        metric = f"bot_{kind}_latency_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for (k, name), (counts, total, total_sum) in sorted(latency.items()):
+            if k != kind: continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_prometheus_labels(**{kind: name, 'le': bound})} {cumulative}")
+            lines.append(f"{metric}_bucket{_prometheus_labels(**{kind: name, 'le': '+Inf'})} {total}")
+            lines.append(f"{metric}_sum{_prometheus_labels(**{kind: name})} {total_sum}")
+            lines.append(f"{metric}_count{_prometheus_labels(**{kind: name})} {total}")
+        lines.append(f"# TYPE bot_{kind}_errors_total counter")
+        lines += [f"bot_{kind}_errors_total{_prometheus_labels(**{kind: n})} {v}" for (k, n), v in sorted(errors.items()) if k == kind]
+        lines.append(f"# TYPE bot_{kind}_in_flight gauge")
+        lines += [f"bot_{kind}_in_flight{_prometheus_labels(**{kind: n})} {v}" for (k, n), v in sorted(in_flight.items()) if k == kind]
+    lines.append("# TYPE bot_events_total counter")
+    lines += [f"bot_events_total{_prometheus_labels(event=k, name=n)} {v}" for (k, n), v in sorted(counters.items())]
+    for name, stats in CACHES.items():
+        for stat, value in stats.stats().items():
+            lines.append(f"bot_cache_{stat}{_prometheus_labels(cache=name)} {value}")
+    for name, lane in LANES.items():
+        lines.append(f"bot_lane_pending{_prometheus_labels(lane=name)} {lane.pending}")
+        lines.append(f"bot_lane_rejected_total{_prometheus_labels(lane=name)} {lane.rejected}")
+    for name, executor in UNBOUNDED_EXECUTORS.items():
+        lines.append(f"bot_executor_queued{_prometheus_labels(executor=name)} {executor_queue_depth(executor)}")
+    for name, gauge in GAUGES.items():
+        lines.append(f"bot_{name} {gauge()}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path != "/metrics": return self._respond(404)
+        body = render_prometheus().encode()
+        self.send_response(200); self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body))); self.end_headers(); self.wfile.write(body)
+
+    def _respond(self, code):
+        self.send_response(code); self.send_header("Content-Length", "0"); self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port):
+    httpd = ThreadingHTTPServer(("0.0.0.0", port), _MetricsRequestHandler); httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on port {port}/metrics")
+    return httpd
+
+# --- ADMISSION CONTROL ---
+COMMAND_COSTS = {"yt": 8, "tts": 5, "qr": 3, "whois": 3, "gen": 2, "rand": 2, "bin": 2, "tr": 2, "github": 2, "weather": 2,
+                 "ip": 2, "short": 2, "paste": 2}
+COMMAND_RATES = {"yt": (3, 6), "tts": (5, 10), "whois": (5, 10)}  # command: (tokens/s, burst) shared by all users
+EXPENSIVE_COST = 3
+# Pools with no queue bound of their own; jobs waiting in them count towards the backlog.
+UNBOUNDED_EXECUTORS = {"http": HTTP_EXECUTOR, "reply": REPLY_EXECUTOR, "tts": TTS_EXECUTOR, "tr": TRANSLATIONS.executor}
+
+def executor_queue_depth(executor):
+    return executor._work_queue.qsize()  # ThreadPoolExecutor has no public count of waiting jobs
+
+class AdmissionController:
+    """Decides whether a command may run before it reaches a handler or lane.
+
+    Every user has a token bucket refilled at `user_rate` tokens/s, and each command
+    costs COMMAND_COSTS tokens (default 1). Commands listed in COMMAND_RATES also
+    draw from a bucket shared by everyone. When the backlog (dispatcher queue, lane
+    queues and jobs waiting in UNBOUNDED_EXECUTORS) passes `soft_watermark`, commands
+    costing EXPENSIVE_COST or more are shed; past `hard_watermark` only cost-1 commands
+    get through.
+    """
+    def __init__(self, user_rate, user_burst, soft_watermark, hard_watermark, max_users=50000):
+        self.user_rate, self.user_burst, self.max_users = user_rate, user_burst, max_users
+        self.soft_watermark, self.hard_watermark = soft_watermark, hard_watermark
+        self._users = OrderedDict()  # user_id -> [TokenBucket, time of last rejection notice]
+        self._commands = {command: TokenBucket(rate, burst) for command, (rate, burst) in COMMAND_RATES.items()}
+        self._lock = threading.Lock()
+
+    def _user(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = [TokenBucket(self.user_rate, self.user_burst), 0.0]
+                if len(self._users) > self.max_users: self._users.popitem(last=False)
+            else: self._users.move_to_end(user_id)
+            return entry
+
+    def backlog(self, dispatcher):
+        return (dispatcher.update_queue.qsize() + sum(lane.pending for lane in LANES.values())
+                + sum(executor_queue_depth(executor) for executor in UNBOUNDED_EXECUTORS.values()))
+
+    def check(self, user_id, command, dispatcher):
+        """Return None to admit the command, or the reason it was rejected."""
+        cost, backlog = COMMAND_COSTS.get(command, 1), self.backlog(dispatcher)
+        if (backlog >= self.hard_watermark and cost > 1) or (backlog >= self.soft_watermark and cost >= EXPENSIVE_COST):
+            return "overload"
+        user_bucket = self._user(user_id)[0]
+        if not user_bucket.try_acquire(cost): return "user_rate"
+        bucket = self._commands.get(command)
+        if bucket and not bucket.try_acquire():
+            user_bucket.refund(cost)
+            return "command_rate"
+        return None
+
+    def should_notify(self, user_id, interval=10.0):
+        """Rate-limit rejection replies so a flooding user doesn't cost us a message per update."""
+        entry, now = self._user(user_id), time.monotonic()
+        if now - entry[1] < interval: return False
+        entry[1] = now
+        return True
+
+ADMISSION = AdmissionController(env_float("ADMISSION_USER_RATE", 1.0), env_float("ADMISSION_USER_BURST", 20),
+                                env_int("ADMISSION_SOFT_WATERMARK", 50), env_int("ADMISSION_HARD_WATERMARK", 200))
+REJECTION_TEXTS = {
+    "overload": "⏳ Busy right now, please try again in a minute.",
+    "user_rate": "⏳ Slow down! You're sending commands too quickly.",
+    "command_rate": "⏳ Busy right now, please try again in a minute.",
+}
+
+def admitted(command, func):
+    """Gate `func` behind ADMISSION; rejected updates get a short notice and are counted in METRICS.
+
+    Admitted updates refresh their sender in USER_STORE, so `last_seen` and the
+    blocked flag follow any command, not just /start.
+    """
+    @functools.wraps(func)
+    def wrapped(update, context, *args, **kwargs):
+        user = update.effective_user
+        reason = None if user is None or user.id == ADMIN_ID else ADMISSION.check(user.id, command, context.dispatcher)
+        if reason is None:
+            if user is not None: USER_STORE.touch(user)
+            return func(update, context, *args, **kwargs)
+        METRICS.incr(f"rejected_{reason}", command)
+        notify = ADMISSION.should_notify(user.id)
+        # A callback query is always answered, silently if need be, or the client keeps its spinner.
+        if update.callback_query: update.callback_query.answer(REJECTION_TEXTS[reason] if notify else None)
+        elif notify: update.effective_message.reply_text(REJECTION_TEXTS[reason])
+    return wrapped
+
+# --- WEBHOOK SERVER ---
+class _WebhookRequestHandler(_MetricsRequestHandler):
+    """Webhook endpoint; answers GET /metrics too when the server was built with `serve_metrics`."""
+    def do_GET(self):
+        if not self.server.hook.serve_metrics: return self._respond(404)
+        super().do_GET()
+
+    def do_POST(self):
+        hook = self.server.hook
+        if self.path != hook.path: return self._respond(404)
+        secret = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+        if not hmac.compare_digest(secret, hook.secret.encode()): return self._respond(403)
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            update = Update.de_json(data, hook.dispatcher.bot) if isinstance(data, dict) else None
+        except Exception: update = None
+        if update is None: return self._respond(400)
+        hook.dispatcher.update_queue.put(update)
+        self._respond(200)
+
+class WebhookServer:
+    """Embedded HTTP endpoint that feeds Telegram webhook updates straight into the dispatcher.
+
+    Requests without the configured secret token are refused. Updates are
+    acknowledged as soon as they are queued; `stop()` closes the listener first
+    and then lets the dispatcher drain what is already queued. The port is public,
+    so the unauthenticated GET /metrics is only served there with `serve_metrics`.
+    """
+    def __init__(self, dispatcher, listen, port, path, secret, serve_metrics=False):
+        if not secret: raise ValueError("WebhookServer needs a secret token")
+        self.dispatcher, self.path, self.secret, self.serve_metrics = dispatcher, path, secret, serve_metrics
+        self._httpd = ThreadingHTTPServer((listen, port), _WebhookRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.hook = self
+
+    def start(self):
+        threading.Thread(target=self.dispatcher.start, name="dispatcher", daemon=True).start()
+        threading.Thread(target=self._httpd.serve_forever, name="webhook", daemon=True).start()
+
+    def stop(self, drain_timeout=15):
+        self._httpd.shutdown(); self._httpd.server_close()
+        deadline = time.monotonic() + drain_timeout
+        while self.dispatcher.update_queue.qsize() and time.monotonic() < deadline: time.sleep(0.1)
+        self.dispatcher.stop()
+
+def start_webhook(updater):
+    """Serve updates over a webhook; registers it with Telegram only when WEBHOOK_URL is set (local runs skip it).
+
+    Without WEBHOOK_SECRET a random token is generated per start and handed to
+    Telegram with the registration, so the endpoint never accepts unsigned updates.
+    WEBHOOK_METRICS=1 also serves GET /metrics on the webhook port.
+    """
+    path = os.environ.get("WEBHOOK_PATH", "/telegram")
+    secret = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    server = WebhookServer(updater.dispatcher, os.environ.get("WEBHOOK_LISTEN", "0.0.0.0"), env_int("PORT", 8443), path, secret,
+                           serve_metrics=os.environ.get("WEBHOOK_METRICS", "0") == "1")
+    server.start()
+    public_url = os.environ.get("WEBHOOK_URL")
+    if public_url:
+        updater.bot.set_webhook(url=public_url.rstrip("/") + path, secret_token=secret,
+                                max_connections=env_int("WEBHOOK_MAX_CONNECTIONS", 40))
+    logger.info(f"Serving webhook on port {server._httpd.server_port}{path}")
+    return server
+
+def wait_for_shutdown():
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM): signal.signal(sig, lambda *_: stop.set())
+    while not stop.wait(1): pass
+
 # --- COMMAND HANDLERS ---
 
 def start(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
-    ALL_USER_IDS.add(user.id) 
     
     keyboard = [
         [InlineKeyboardButton("🤖 All Commands", callback_data='help_main')],
@@ -96,7 +1106,7 @@ def help_callback(update: Update, context: CallbackContext) -> None:
         'card': "*💳 BIN Tools:*\n`/gen <BIN> [MM] [YY] [CVC]`\n`/bin <BIN>`\n`/check <card>`\n`/rand`",
         'info': "*🌐 Network, Device & Info Tools:*\n`/ip <ip>`\n`/phone <number>`\n`/whois <domain>`\n`/github <user>`\n`/imei <imei>`\n`/weather <city>`\n`/myinfo`",
         'power': "*🛠️ Power Tools:*\n`/tr <lang> <text>`\n`/yt <url>`\n`/qr <text>`\n`/short <url>`\n`/paste <text>`\n`/tts <lang> <text>`",
-        'bot': "*🤖 Admin & Bot Management:*\n`/start`\n`/help`\n`/broadcast <msg>`\n`/feedback`\n`/ping`\n`/uptime`"
+        'bot': "*🤖 Admin & Bot Management:*\n`/start`\n`/help`\n`/broadcast <msg>`\n`/stats`\n`/feedback`\n`/ping`\n`/uptime`"
     }
     
     back_button = [[InlineKeyboardButton("⬅️ Back to menu", callback_data='help_main')]]
@@ -123,13 +1133,27 @@ def help_callback(update: Update, context: CallbackContext) -> None:
 def broadcast(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/broadcast <message>`"); return
     msg_to_send = " ".join(context.args); message = update.message.reply_text(f"Broadcasting...")
-    count = 0
-    for user_id in ALL_USER_IDS:
-        try:
-            context.bot.send_message(chat_id=user_id, text=f"📢 *Admin Broadcast:*\n\n{msg_to_send}", parse_mode=ParseMode.MARKDOWN)
-            count += 1
-        except Exception: logger.warning(f"Could not send to user {user_id}")
-    message.edit_text(f"Broadcast sent to {count} users.")
+    BROADCASTER.start(context.bot, f"📢 *Admin Broadcast:*\n\n{msg_to_send}", message.chat_id, message.message_id)
+@restricted
+def stats(update: Update, context: CallbackContext) -> None:
+    lines = [f"Uptime: {get_uptime()} | Update queue: {context.dispatcher.update_queue.qsize()}", ""]
+    with METRICS._lock:
+        rows = [(kind, name, h.total, h.quantile(0.5), h.quantile(0.99), METRICS.errors[(kind, name)], METRICS.in_flight[(kind, name)])
+                for (kind, name), h in sorted(METRICS.latency.items())]
+    for kind in ("handler", "upstream"):
+        lines.append(f"{kind.capitalize()}s (calls  p50  p99  errors  in-flight):")
+        lines += [f"  {name:<14}{calls:>6} {p50 * 1000:>5.0f}ms {p99 * 1000:>5.0f}ms {errors:>4} {busy:>3}"
+                  for k, name, calls, p50, p99, errors, busy in rows if k == kind] or ["  (none yet)"]
+    lines.append("Caches (hits/stale/misses/evictions):")
+    lines += [f"  {name:<12}{c['hits']}/{c['stale_hits']}/{c['misses']}/{c['evictions']} size {c['size']}"
+              for name, c in ((name, cache.stats()) for name, cache in CACHES.items())]
+    lines.append("Lanes (pending/rejected):")
+    lines += [f"  {name:<8}{lane.pending}/{lane.rejected}" for name, lane in LANES.items()]
+    lines.append("Pools (queued): " + ", ".join(f"{name} {executor_queue_depth(executor)}" for name, executor in UNBOUNDED_EXECUTORS.items()))
+    with METRICS._lock: rejected = sorted((k[len("rejected_"):], n, v) for (k, n), v in METRICS.counters.items() if k.startswith("rejected_"))
+    lines.append(f"Admission (backlog {ADMISSION.backlog(context.dispatcher)}), rejected:")
+    lines += [f"  {name:<10}{reason:<14}{count}" for reason, name, count in rejected] or ["  (none)"]
+    update.message.reply_text("```\n" + "\n".join(lines) + "\n```", parse_mode=ParseMode.MARKDOWN)
 def feedback_start(update: Update, context: CallbackContext) -> int:
     if update.callback_query: update.callback_query.answer(); update.callback_query.message.reply_text("Please write your feedback. To cancel: /cancel.")
     else: update.message.reply_text("Please write your feedback. To cancel: /cancel.")
@@ -163,7 +1187,7 @@ def generate_card(bin_number, month=None, year=None, cvv=None):
     return f"{card_number}|{exp_month}|{exp_year}|{gen_cvv}"
 def get_bin_info(bin_number):
     try:
-        data = requests.get(f"https://lookup.binlist.net/{bin_number[:6]}").json()
+        data = http_request("GET", f"https://lookup.binlist.net/{bin_number[:6]}").json()
         return (f"🔹 **Issuer:** {data.get('bank', {}).get('name', 'N/A')}\n"
                 f"🔹 **Country:** {data.get('country', {}).get('name', 'N/A')}\n"
                 f"🔹 **Type:** {data.get('type', 'N/A').capitalize()}\n"
@@ -191,20 +1215,23 @@ def rand_command(update: Update, context: CallbackContext) -> None:
 def ip_lookup(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/ip <ip_address>`"); return
     ip = context.args[0]
-    try:
-        data = requests.get(f"http://ip-api.com/json/{ip}").json()
-        if data['status'] == 'success':
-            res = (f"🔍 **IP Information for `{ip}`**\n\n"
-                   f"Country: `{data.get('country', 'N/A')}`\n"
-                   f"Region: `{data.get('regionName', 'N/A')}`\n"
-                   f"City: `{data.get('city', 'N/A')}`\n"
-                   f"ZIP Code: `{data.get('zip', 'N/A')}`\n"
-                   f"Coordinates: `{data.get('lat', 0)}, {data.get('lon', 0)}`\n"
-                   f"ISP: `{data.get('isp', 'N/A')}`\n"
-                   f"Organization: `{data.get('org', 'N/A')}`")
-            update.message.reply_text(res, parse_mode=ParseMode.MARKDOWN)
-        else: update.message.reply_text("Could not find info for this IP.")
-    except: update.message.reply_text("An error occurred.")
+    def done(future):
+        try:
+            data = future.result()
+            if data['status'] == 'success':
+                res = (f"🔍 **IP Information for `{ip}`**\n\n"
+                       f"Country: `{data.get('country', 'N/A')}`\n"
+                       f"Region: `{data.get('regionName', 'N/A')}`\n"
+                       f"City: `{data.get('city', 'N/A')}`\n"
+                       f"ZIP Code: `{data.get('zip', 'N/A')}`\n"
+                       f"Coordinates: `{data.get('lat', 0)}, {data.get('lon', 0)}`\n"
+                       f"ISP: `{data.get('isp', 'N/A')}`\n"
+                       f"Organization: `{data.get('org', 'N/A')}`")
+                update.message.reply_text(res, parse_mode=ParseMode.MARKDOWN)
+            else: update.message.reply_text("Could not find info for this IP.")
+        except: update.message.reply_text("An error occurred.")
+    key = ip.strip().lower()
+    return then(IP_CACHE.get_async(key, lambda: fetch_json(f"http://ip-api.com/json/{key}")), done)
 def phone_lookup(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/phone <phone_number_with_country_code>`"); return
     num = " ".join(context.args)
@@ -229,34 +1256,48 @@ def phone_lookup(update: Update, context: CallbackContext) -> None:
                f"Timezone(s): `🌏 {', '.join(timezone) or 'N/A'}`")
         update.message.reply_text(res, parse_mode=ParseMode.MARKDOWN)
     except Exception as e: update.message.reply_text(f"Could not parse number. Ensure it includes '+'.\nError: {e}")
+def fetch_whois(domain):
+    with METRICS.track("upstream", "whois"): w = whois.whois(domain)
+    return {"registrar": str(w.registrar), "creation_date": str(w.creation_date),
+            "expiration_date": str(w.expiration_date), "name_servers": list(w.name_servers)}
 def whois_lookup(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/whois <domain>` (e.g., google.com)"); return
     domain = context.args[0]
-    try:
-        w = whois.whois(domain)
-        res = (f"🌐 **Whois for `{domain}`**\n\n"
-               f"Registrar: `{w.registrar}`\n"
-               f"Creation Date: `{w.creation_date}`\n"
-               f"Expiration Date: `{w.expiration_date}`\n"
-               f"Name Servers: `\n- {'\n- '.join(w.name_servers)}`")
-        update.message.reply_text(res, parse_mode=ParseMode.MARKDOWN)
-    except: update.message.reply_text("Could not fetch Whois information.")
+    def done(future):
+        try:
+            w = future.result(); name_servers = '\n- '.join(w['name_servers'])
+            res = (f"🌐 **Whois for `{domain}`**\n\n"
+                   f"Registrar: `{w['registrar']}`\n"
+                   f"Creation Date: `{w['creation_date']}`\n"
+                   f"Expiration Date: `{w['expiration_date']}`\n"
+                   f"Name Servers: `\n- {name_servers}`")
+            update.message.reply_text(res, parse_mode=ParseMode.MARKDOWN)
+        except: update.message.reply_text("Could not fetch Whois information.")
+    key = domain.strip().lower().rstrip('.')
+    # whois.whois blocks on a port-43 socket, so it runs on the bounded lookup lane rather than the shared HTTP pool.
+    try: return then(WHOIS_CACHE.get_async(key, lambda: fetch_whois(key), LANES["lookup"]), done)
+    except LaneFull: update.message.reply_text(LANE_BUSY_TEXT)
 def github_lookup(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/github <username>`"); return
     username = context.args[0]
-    try:
-        data = requests.get(f"https://api.github.com/users/{username}").json()
-        if data.get("message") == "Not Found": update.message.reply_text("User not found."); return
-        
-        res = (f"👨‍💻 **GitHub User: {data.get('login')}**\n\n"
-               f"**Name:** {data.get('name', 'N/A')}\n"
-               f"**Bio:** {data.get('bio', 'N/A')}\n"
-               f"**Followers:** {data.get('followers', 0)}\n"
-               f"**Following:** {data.get('following', 0)}\n"
-               f"**Public Repos:** {data.get('public_repos', 0)}\n"
-               f"**Profile Link:** {data.get('html_url')}")
-        context.bot.send_photo(chat_id=update.effective_chat.id, photo=data.get('avatar_url'), caption=res, parse_mode=ParseMode.MARKDOWN)
-    except: update.message.reply_text("An error occurred.")
+    def done(future):
+        try:
+            data = future.result()
+            if data.get("message") == "Not Found": update.message.reply_text("User not found."); return
+
+            res = (f"👨‍💻 **GitHub User: {data.get('login')}**\n\n"
+                   f"**Name:** {data.get('name', 'N/A')}\n"
+                   f"**Bio:** {data.get('bio', 'N/A')}\n"
+                   f"**Followers:** {data.get('followers', 0)}\n"
+                   f"**Following:** {data.get('following', 0)}\n"
+                   f"**Public Repos:** {data.get('public_repos', 0)}\n"
+                   f"**Profile Link:** {data.get('html_url')}")
+            send = lambda photo: context.bot.send_photo(chat_id=update.effective_chat.id, photo=photo, caption=res, parse_mode=ParseMode.MARKDOWN)
+            # avatar_url stays the same when the picture changes, so the profile's updated_at versions the key
+            reply_cached_media(media_key("avatar", data.get('avatar_url'), data.get('updated_at')), send, lambda: data.get('avatar_url'))
+        except: update.message.reply_text("An error occurred.")
+    key = username.strip().lower()
+    return then(GITHUB_CACHE.get_async(key, lambda: fetch_json(f"https://api.github.com/users/{key}")), done)
 def imei_lookup(update: Update, context: CallbackContext) -> None:
     if not context.args or not context.args[0].isdigit(): update.message.reply_text("Usage: `/imei <imei_number>`"); return
     imei = context.args[0]
@@ -265,93 +1306,104 @@ def weather(update: Update, context: CallbackContext) -> None:
     api_key = os.environ.get("WEATHER_API_KEY")
     if not api_key: update.message.reply_text("Weather API key not configured."); return
     if not context.args: update.message.reply_text("Usage: `/weather <city>`"); return
-    city = ' '.join(context.args); url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={api_key}&units=metric"
-    try:
-        res = requests.get(url).json()
-        if res["cod"] == 200:
-            msg = (f"*Weather in {res['name']}, {res['sys']['country']}*\n"
-                   f"Condition: *{res['weather'][0]['description'].capitalize()}*\n"
-                   f"Temp: *{res['main']['temp']}°C* | Humidity: *{res['main']['humidity']}%*")
-            update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
-        else: update.message.reply_text(f"Could not find weather for '{city}'.")
-    except: update.message.reply_text("Error fetching weather data.")
+    city = ' '.join(context.args); key = city.casefold(); url = f"http://api.openweathermap.org/data/2.5/weather?q={key}&appid={api_key}&units=metric"
+    def done(future):
+        try:
+            res = future.result()
+            if res["cod"] == 200:
+                msg = (f"*Weather in {res['name']}, {res['sys']['country']}*\n"
+                       f"Condition: *{res['weather'][0]['description'].capitalize()}*\n"
+                       f"Temp: *{res['main']['temp']}°C* | Humidity: *{res['main']['humidity']}%*")
+                update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+            else: update.message.reply_text(f"Could not find weather for '{city}'.")
+        except: update.message.reply_text("Error fetching weather data.")
+    return then(WEATHER_CACHE.get_async(key, lambda: fetch_json(url)), done)
 
 # --- POWER TOOLS ---
 def tr(update: Update, context: CallbackContext) -> None:
     if not context.args or len(context.args) < 2: update.message.reply_text("Usage: `/tr <lang_code> <text>`\nEx: `/tr bn I am a bot`"); return
     lang = context.args[0]; text = " ".join(context.args[1:])
-    try:
-        translated = Translator().translate(text, dest=lang)
-        update.message.reply_text(f"Translated to *{lang.upper()}*:\n\n`{translated.text}`", parse_mode=ParseMode.MARKDOWN)
-    except: update.message.reply_text("Could not translate. Ensure language code is correct.")
+    def done(future):
+        try: update.message.reply_text(f"Translated to *{lang.upper()}*:\n\n`{future.result()}`", parse_mode=ParseMode.MARKDOWN)
+        except: update.message.reply_text("Could not translate. Ensure language code is correct.")
+    return then(TRANSLATIONS.translate_async(lang, text), done)
 def yt(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/yt <youtube_url>`"); return
-    url = context.args[0]; msg = update.message.reply_text("⏳ Fetching video info...")
-    ydl_opts = {'quiet': True, 'skip_download': True, 'force_generic_extractor': True, 'noplaylist': True}
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title, duration = info.get('title', 'N/A'), str(timedelta(seconds=info.get('duration', 0)))
-            links = []
-            for f in info.get('formats', []):
-                if f.get('filesize') and f.get('url'):
-                    filesize_mb = round(f['filesize'] / 1048576, 2)
-                    links.append(f"[{f.get('format_note', 'video/audio')} ({filesize_mb} MB)]({f.get('url')})")
-            
-            res_text = f"*{'🎥 ' + title}*\n*⏳ Duration: {duration}*\n\n*Download Links:*\n" + "\n".join(links[:7])
-            msg.edit_text(res_text, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
-    except: msg.edit_text("Could not process YouTube link. Ensure it is a valid video URL.")
+    try: future = get_video_info(context.args[0])
+    except LaneFull: update.message.reply_text(LANE_BUSY_TEXT); return
+    msg = None if future.done() else update.message.reply_text("⏳ Fetching video info...")
+    def done(future):
+        reply = msg.edit_text if msg else update.message.reply_text
+        try:
+            info = future.result()
+            title, duration = info['title'], str(timedelta(seconds=info['duration']))
+            links = [f"[{f['note']} ({round(f['size'] / 1048576, 2)} MB)]({f['url']})" for f in info['links']]
+            res_text = f"*{'🎥 ' + title}*\n*⏳ Duration: {duration}*\n\n*Download Links:*\n" + "\n".join(links)
+            reply(res_text, parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+        except: reply("Could not process YouTube link. Ensure it is a valid video URL.")
+    return then(future, done)
 def qr(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/qr <text>`"); return
-    text = ' '.join(context.args); img = qrcode.make(text); bio = BytesIO(); bio.name = 'qrcode.png'; img.save(bio, 'PNG'); bio.seek(0)
-    update.message.reply_photo(photo=bio, caption=f"QR code for:\n`{text}`", parse_mode=ParseMode.MARKDOWN)
+    text = ' '.join(context.args)
+    def render():
+        img = qrcode.make(text); bio = BytesIO(); bio.name = 'qrcode.png'; img.save(bio, 'PNG'); bio.seek(0)
+        return bio
+    send = lambda photo: update.message.reply_photo(photo=photo, caption=f"QR code for:\n`{text}`", parse_mode=ParseMode.MARKDOWN)
+    reply_cached_media(media_key("qr", text), send, render)
 def short(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/short <url>`"); return
-    try: res = requests.get(f"http://tinyurl.com/api-create.php?url={context.args[0]}"); update.message.reply_text(f"Shortened URL: `{res.text}`", parse_mode=ParseMode.MARKDOWN)
-    except Exception as e: update.message.reply_text(f"Error: {e}")
+    def done(future):
+        try: res = future.result(); update.message.reply_text(f"Shortened URL: `{res.text}`", parse_mode=ParseMode.MARKDOWN)
+        except Exception as e: update.message.reply_text(f"Error: {e}")
+    return then(http_request_async("GET", "http://tinyurl.com/api-create.php", params={"url": context.args[0]}), done)
 def paste(update: Update, context: CallbackContext) -> None:
     if not context.args: update.message.reply_text("Usage: `/paste <text>`"); return
     text = " ".join(context.args)
-    try: res = requests.post("https://hastebin.com/documents", data=text.encode('utf-8')); update.message.reply_text(f"Pasted: https://hastebin.com/{res.json()['key']}")
-    except: update.message.reply_text("Error creating paste.")
+    def done(future):
+        try: res = future.result(); update.message.reply_text(f"Pasted: https://hastebin.com/{res.json()['key']}")
+        except: update.message.reply_text("Error creating paste.")
+    return then(http_request_async("POST", "https://hastebin.com/documents", data=text.encode('utf-8')), done)
 def tts(update: Update, context: CallbackContext) -> None:
     if not context.args or len(context.args) < 2: update.message.reply_text("Usage: `/tts <lang> <text>`\nEx: `/tts en Hello`"); return
     lang, text = context.args[0], " ".join(context.args[1:])
-    try:
-        tts = gTTS(text=text, lang=lang); audio_file = BytesIO(); tts.write_to_fp(audio_file); audio_file.name = 'voice.ogg'; audio_file.seek(0)
-        update.message.reply_audio(audio=audio_file)
-    except: update.message.reply_text("An error occurred. Check language code.")
+    with tempfile.TemporaryFile(suffix='.mp3') as audio_file:
+        def render():
+            synthesize_speech(lang, text, audio_file); audio_file.seek(0)
+            return audio_file
+        send = lambda audio: update.message.reply_audio(audio=audio, filename='voice.ogg')
+        try: reply_cached_media(media_key("tts", lang.lower(), text), send, render)
+        except: update.message.reply_text("An error occurred. Check language code.")
+
+# --- BOT INFO ---
+def ping(update: Update, context: CallbackContext) -> None:
+    update.message.reply_text("🏓 Pong!")
+def uptime(update: Update, context: CallbackContext) -> None:
+    update.message.reply_text(f"⏱️ Uptime: `{get_uptime()}`", parse_mode=ParseMode.MARKDOWN)
+def myinfo_command(update: Update, context: CallbackContext) -> None:
+    user = update.effective_user
+    update.message.reply_text(f"👤 **Your Info**\n\nName: `{user.full_name}`\nUsername: `@{user.username}`\n"
+                              f"User ID: `{user.id}`\nChat ID: `{update.effective_chat.id}`", parse_mode=ParseMode.MARKDOWN)
 
 # ================================================================= #
 # ==                  MAIN LOGIC TO START THE BOT                == #
 # ================================================================= #
-def main():
-    """Main function to setup and run the bot."""
-    bot_token = os.environ.get("BOT_TOKEN")
-    if not bot_token:
-        logger.critical("FATAL: BOT_TOKEN environment variable not found!")
-        return
-
-    updater = Updater(bot_token, use_context=True)
-    dp = updater.dispatcher
-
+def register_handlers(dp):
+    """Attach every conversation, callback and command handler to the dispatcher `dp`."""
     # Add ConversationHandler for feedback
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('feedback', feedback_start), CallbackQueryHandler(feedback_start, pattern='^feedback_start$')],
-        states={FEEDBACK_STATE: [MessageHandler(Filters.text & ~Filters.command, get_feedback)]},
-        fallbacks=[CommandHandler('cancel', cancel_feedback)],
+        entry_points=[CommandHandler('feedback', admitted("feedback", feedback_start)),
+                      CallbackQueryHandler(admitted("feedback", feedback_start), pattern='^feedback_start$')],
+        states={FEEDBACK_STATE: [MessageHandler(Filters.text & ~Filters.command, admitted("feedback", get_feedback))]},
+        fallbacks=[CommandHandler('cancel', admitted("cancel", cancel_feedback))],
     )
     dp.add_handler(conv_handler)
     
     # Add other handlers
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("help", help_command))
-    dp.add_handler(CallbackQueryHandler(help_callback, pattern='^help_'))
-    dp.add_handler(CallbackQueryHandler(notes_callback, pattern='^notes_show$'))
-    dp.add_handler(CommandHandler("save", save_note))
-    dp.add_handler(CommandHandler("notes", show_notes))
-    dp.add_handler(CommandHandler("delete", delete_note))
-    dp.add_handler(CommandHandler("broadcast", broadcast))
+    dp.add_handler(CommandHandler("start", admitted("start", instrumented("start", start))))
+    dp.add_handler(CommandHandler("help", admitted("help", instrumented("help", help_command))))
+    dp.add_handler(CallbackQueryHandler(admitted("help", help_callback), pattern='^help_'))
+    dp.add_handler(CommandHandler("broadcast", admitted("broadcast", instrumented("broadcast", broadcast))))
+    dp.add_handler(CommandHandler("stats", admitted("stats", stats)))
 
     # List of all commands and their functions
     command_list = {
@@ -362,11 +1414,42 @@ def main():
     }
 
     for command, func in command_list.items():
-        dp.add_handler(CommandHandler(command, func))
+        dp.add_handler(CommandHandler(command, admitted(command, scheduled(command, instrumented(command, func)))))
+
+def main():
+    """Main function to setup and run the bot."""
+    boot = StartupTimer(BOOT_STARTED); boot.mark("imports")
+    bot_token = os.environ.get("BOT_TOKEN")
+    if not bot_token:
+        logger.critical("FATAL: BOT_TOKEN environment variable not found!")
+        return
+
+    con_pool_size = sum(lane.workers for lane in LANES.values()) + REPLY_WORKERS + 4
+    updater = Updater(bot_token, use_context=True, workers=env_int("DISPATCHER_WORKERS", 4),
+                      request_kwargs={"con_pool_size": con_pool_size})
+    dp = updater.dispatcher
+    register_handlers(dp)
+    GAUGES["dispatcher_queue_depth"] = dp.update_queue.qsize
+    if os.environ.get("METRICS_PORT"): start_metrics_server(env_int("METRICS_PORT", 9100))
+    boot.mark("handlers")
+    updater.bot.get_me(); boot.mark("connect")
 
-    logger.info("Starting Ultimate Bot polling on Render...")
-    updater.start_polling()
-    updater.idle()
+    webhook_mode = os.environ.get("BOT_MODE", "polling").lower() == "webhook"
+    if webhook_mode:
+        server = start_webhook(updater)
+    else:
+        logger.info("Starting Ultimate Bot polling on Render...")
+        updater.start_polling()
+    boot.mark("serving"); boot.report()
+    if os.environ.get("WARMUP_IMPORTS", "0") == "1": warm_up()
+    BROADCASTER.resume(updater.bot)
+    if webhook_mode:
+        wait_for_shutdown()
+        server.stop()
+    else:
+        updater.idle()
+    BROADCASTER.stop()
+    USER_STORE.close()
 
 if __name__ == '__main__':
     main()